@@ -4,4 +4,6 @@
 from . import dataproviders
 from . import model
 from . import engine
-from . import wofost
\ No newline at end of file
+from . import wofost
+from . import waterbalance
+from . import workers
@@ -2,6 +2,7 @@
 # Copyright (c) 2019 Wageningeni Environmental Research, Wageningen-UR
 # Allard de Wit (allard.dewit@wur.nl), December 2019
 import os, sys
+import glob
 import collections
 from pathlib import Path
 
@@ -13,27 +14,77 @@ from pcse.util import check_date
 from pcse.fileinput import YAMLAgroManagementReader
 
 
-def read_agromanagement(conf, aez, crop_rotation_type, _cache={}):
-    """Reads the proper agromanagement file for given EAZ and crop rotation type
+def get_agromanagement_filename(conf, aez, crop_rotation_type):
+    """Returns the path to the agromanagement file for given AEZ and crop rotation type
 
     :param conf: the configuration file specifying path locations
     :param aez: the AEZ number
     :param crop_rotation_type: the crop rotation type number
-    :return: a AgroManagement definition in YAML
+    :return: a Path object pointing to the YAML agromanagement file
     """
-    if (aez, crop_rotation_type) not in _cache:
-        agro_location = Path(conf.agromanagement_definitions.location)
-        agro_definition_fname = agro_location / ("AEZ_%03i" % aez) / ("rotation_type_%02i.yaml" % crop_rotation_type)
-        agro_definition = YAMLAgroManagementReader(agro_definition_fname)
-        _cache[(aez, crop_rotation_type)] = agro_definition
-    else:
-        agro_definition = _cache[(aez, crop_rotation_type)]
+    agro_location = Path(conf.agromanagement_definitions.location)
+    return agro_location / ("AEZ_%03i" % aez) / ("rotation_type_%02i.yaml" % crop_rotation_type)
 
-    return agro_definition
+
+class AgroManagementCache:
+    """Caches the agromanagement definitions per AEZ and crop rotation type.
+
+    Each definition is stored together with the modification time of the file it
+    was read from. Calling `refresh()` drops the definitions whose file has changed
+    on disk, so that they are re-read on the next request.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self._cache = {}
+
+    def __call__(self, aez, crop_rotation_type):
+        """Returns the agromanagement definition for given AEZ and crop rotation type
+
+        :param aez: the AEZ number
+        :param crop_rotation_type: the crop rotation type number
+        :return: a AgroManagement definition in YAML
+        """
+        key = (int(aez), int(crop_rotation_type))
+        if key not in self._cache:
+            fname = get_agromanagement_filename(self.config, *key)
+            mtime = os.path.getmtime(fname)
+            self._cache[key] = (mtime, YAMLAgroManagementReader(fname))
+
+        return self._cache[key][1]
+
+    def refresh(self):
+        """Removes cached definitions whose file was modified or removed since it was read.
+
+        :return: a set of (aez, crop_rotation_type) keys that were removed from the cache.
+        """
+        stale = set()
+        for key, (mtime, _) in self._cache.items():
+            fname = get_agromanagement_filename(self.config, *key)
+            if not os.path.exists(fname) or os.path.getmtime(fname) != mtime:
+                stale.add(key)
+        for key in stale:
+            del self._cache[key]
+
+        return stale
 
 
 class WFLOWWeatherDataProvider(WeatherDataProvider):
     """Class for reading Meteodata in WFLOW NetCDF structure.
+
+    The weather location in the configuration can be a single NetCDF file, a glob
+    pattern or a list of files and/or glob patterns. At startup an index is built that
+    maps each day to the file and time index where it can be found. When the same day
+    occurs in several files, the file that sorts last takes precedence. Open files
+    are kept in a pool of at most `weather_variables.max_open_files` (default 4)
+    datasets, the least recently used dataset is closed when the pool is full.
+
+    The weather grid can differ from the model grid. The mapping of model cells to
+    weather cells is set by `weather_variables.grid_mapping`: "identity" (default)
+    requires both grids to be equal, "nearest" maps each model cell to the nearest
+    weather cell using the model grid coordinates. Each day, one container with the
+    driving variables is built per weather cell and shared by all model cells that
+    map to it. The containers are discarded when a new day is read.
     """
     config = None
     latitude = None
@@ -42,47 +93,180 @@ class WFLOWWeatherDataProvider(WeatherDataProvider):
     active_day = None
     active_layers = {}
     weather_data_container = collections.namedtuple("WeatherDataContainer","LAT LON DAY TMIN TMAX TEMP DTEMP RAIN ET0, ES0, E0, IRRAD")
+    max_open_files = 4
+    grid_mappings = ("identity", "nearest")
 
-    def __init__(self, config):
+    def __init__(self, config, grid_latitude=None, grid_longitude=None):
+        """
+        :param config: the GriddedWOFOSTBMI configuration
+        :param grid_latitude: latitude of each row of the model grid, required for
+            the "nearest" grid mapping.
+        :param grid_longitude: longitude of each column of the model grid, required
+            for the "nearest" grid mapping.
+        """
         self.config = config
-        if not os.path.exists(self.config.weather_variables.location):
-            msg = f"Input file {self.config.weather_variables.location} does not exists!"
+        self.grid_mapping = self.config.weather_variables.grid_mapping or "identity"
+        if self.grid_mapping not in self.grid_mappings:
+            msg = f"Unknown grid mapping '{self.grid_mapping}', should be one of {list(self.grid_mappings)}"
+            raise RuntimeError(msg)
+        if self.config.weather_variables.max_open_files:
+            self.max_open_files = int(self.config.weather_variables.max_open_files)
+        self.files = []
+        self.index = {}
+        self._file_days = {}
+        self._pool = collections.OrderedDict()
+        self._containers = {}
+
+        self.refresh_index()
+        if not self.files:
+            msg = f"No input files found for {self.config.weather_variables.location}!"
             raise RuntimeError(msg)
 
-        with xarray.open_dataset(self.config.weather_variables.location) as ds:
-            gd = self.config.maps.metadata
-            if ds.lat.shape != (gd.nrows,) and ds.lon.shape != (gd.ncols,):
-                raise RuntimeError("Input weather grid not equal to grid definition in configuration")
+        # Weather row/col for each model row/col
+        if self.grid_mapping == "nearest":
+            if grid_latitude is None or grid_longitude is None:
+                raise RuntimeError("Grid mapping 'nearest' requires the coordinates of the model grid")
+            self._check_grid_extent(np.asarray(grid_latitude), np.asarray(grid_longitude))
+            self.row_map = np.abs(np.subtract.outer(np.asarray(grid_latitude), self.latitude)).argmin(axis=1)
+            self.col_map = np.abs(np.subtract.outer(np.asarray(grid_longitude), self.longitude)).argmin(axis=1)
+        else:
+            self.row_map = np.arange(len(self.latitude))
+            self.col_map = np.arange(len(self.longitude))
 
-            # Store lat/lon for further use
-            self.latitude = np.array(ds.lat)
-            self.longitude = np.array(ds.lon)
+    def _check_grid_extent(self, grid_latitude, grid_longitude):
+        """Checks that the weather grid covers the model grid.
+        """
+        for name, weather_coords, grid_coords in (("latitude", self.latitude, grid_latitude),
+                                                  ("longitude", self.longitude, grid_longitude)):
+            half_cell = np.abs(np.diff(weather_coords)).max()/2. if len(weather_coords) > 1 else 0.
+            lower = weather_coords.min() - half_cell
+            upper = weather_coords.max() + half_cell
+            if grid_coords.min() < lower or grid_coords.max() > upper:
+                msg = f"Weather grid {name} range {lower:.4f}..{upper:.4f} does not cover the model grid " \
+                      f"{name} range {grid_coords.min():.4f}..{grid_coords.max():.4f}!"
+                raise RuntimeError(msg)
+
+    def _find_files(self):
+        """Returns the sorted list of files matching the configured weather location(s).
+        """
+        locations = self.config.weather_variables.location
+        if isinstance(locations, str):
+            locations = [locations]
+
+        files = set()
+        for location in locations:
+            location = str(location)
+            if glob.has_magic(location):
+                files.update(glob.glob(location))
+            elif os.path.exists(location):
+                files.add(location)
+            else:
+                msg = f"Input file {location} does not exists!"
+                raise RuntimeError(msg)
+        return sorted(files)
+
+    def refresh_index(self):
+        """Adds the files that appeared since the index was built to the date index.
+
+        This allows to append new weather files during near-real-time runs.
+        """
+        gd = self.config.maps.metadata
+        new_files = [f for f in self._find_files() if f not in self._file_days]
+        if not new_files:
+            return
+
+        for fname in new_files:
+            with xarray.open_dataset(fname) as ds:
+                if self.grid_mapping == "identity" and \
+                        (ds.lat.shape != (gd.nrows,) or ds.lon.shape != (gd.ncols,)):
+                    raise RuntimeError("Input weather grid not equal to grid definition in configuration")
+
+                # Store lat/lon for further use
+                if self.latitude is None:
+                    self.latitude = np.array(ds.lat)
+                    self.longitude = np.array(ds.lon)
+                elif not (np.array_equal(self.latitude, ds.lat) and np.array_equal(self.longitude, ds.lon)):
+                    raise RuntimeError(f"Weather grid in {fname} differs from the other weather files")
+
+                self._file_days[fname] = [timestamp.date() for timestamp in ds.indexes["time"]]
+
+        # Rebuild the index in sorted file order, so later files take precedence
+        self.files = sorted(self._file_days)
+        self.index = {}
+        for fname in self.files:
+            for time_index, day in enumerate(self._file_days[fname]):
+                self.index[day] = (fname, time_index)
+
+    def _get_dataset(self, fname):
+        """Returns an open dataset from the pool, opening it when needed.
+        """
+        if fname in self._pool:
+            self._pool.move_to_end(fname)
+            return self._pool[fname]
+
+        while len(self._pool) >= self.max_open_files:
+            _, ds = self._pool.popitem(last=False)
+            ds.close()
+        ds = xarray.open_dataset(fname)
+        self._pool[fname] = ds
+        return ds
+
+    def close(self):
+        """Closes all open datasets in the pool.
+        """
+        while self._pool:
+            _, ds = self._pool.popitem()
+            ds.close()
 
     def _read_new_layer(self, day):
-        with xarray.open_dataset(self.config.weather_variables.location) as ds:
-            ds_oneday = ds.sel(time=day)
-            ds_oneday.load()
-            self.active_layers = \
-                dict(TEMP=ds_oneday.data_vars["TEMP"],
-                     ET0=ds_oneday.data_vars["PET"]/10.,
-                     ES0=ds_oneday.data_vars["PET"]/10.,
-                     E0=ds_oneday.data_vars["PET"]/10.,
-                     TMIN=self._create_dummy_TMIN(day, ds_oneday.data_vars["TEMP"]),
-                     TMAX=self._create_dummy_TMAX(day, ds_oneday.data_vars["TEMP"]),
-                     IRRAD=self._create_dummy_IRRAD(day, ds_oneday.data_vars["PET"]),
-                     DTEMP=ds_oneday.data_vars["TEMP"] + 2.5,
-                     RAIN=ds_oneday.data_vars["P"]/10.)
+        if day not in self.index:
+            self.refresh_index()
+        if day not in self.index:
+            msg = f"No weather data available for day {day}!"
+            raise RuntimeError(msg)
 
-    def __call__(self, day, row, col):
+        fname, time_index = self.index[day]
+        ds_oneday = self._get_dataset(fname).isel(time=time_index)
+        ds_oneday.load()
+        TEMP = np.asarray(ds_oneday.data_vars["TEMP"], dtype=np.float64)
+        PET = np.asarray(ds_oneday.data_vars["PET"], dtype=np.float64)
+        self.active_layers = \
+            dict(TEMP=TEMP,
+                 ET0=PET/10.,
+                 ES0=PET/10.,
+                 E0=PET/10.,
+                 TMIN=self._create_dummy_TMIN(day, TEMP),
+                 TMAX=self._create_dummy_TMAX(day, TEMP),
+                 IRRAD=self._create_dummy_IRRAD(day, PET),
+                 DTEMP=TEMP + 2.5,
+                 RAIN=np.asarray(ds_oneday.data_vars["P"], dtype=np.float64)/10.)
+        self._containers = {}
+
+    def _set_active_day(self, day):
         day = check_date(day)
         if day != self.active_day:
             self._read_new_layer(day)
             self.active_day = day
+        return day
+
+    def get_layer(self, day, varname):
+        """Returns the values of given weather variable on given day for the whole model grid.
+        """
+        self._set_active_day(day)
+        return self.active_layers[varname][np.ix_(self.row_map, self.col_map)]
+
+    def __call__(self, day, row, col):
+        day = self._set_active_day(day)
 
-        meteo_vars = {"LAT": self.latitude[row], "LON": self.longitude[col], "DAY": day}
-        for varname, meteo_variable in self.active_layers.items():
-            meteo_vars[varname] = float(meteo_variable[row, col].values)
-        return self.weather_data_container(**meteo_vars)
+        # The container is immutable and shared by all model cells in the same weather cell
+        weather_cell = (self.row_map[row], self.col_map[col])
+        if weather_cell not in self._containers:
+            w_row, w_col = weather_cell
+            meteo_vars = {"LAT": self.latitude[w_row], "LON": self.longitude[w_col], "DAY": day}
+            for varname, meteo_variable in self.active_layers.items():
+                meteo_vars[varname] = float(meteo_variable[w_row, w_col])
+            self._containers[weather_cell] = self.weather_data_container(**meteo_vars)
+        return self._containers[weather_cell]
 
     def _create_dummy_TMIN(self, day, TEMP):
         return TEMP - 5.
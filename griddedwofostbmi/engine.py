@@ -11,21 +11,48 @@ class GridAwareEngine(Engine):
     The only difference is that the GridAwareEngine is "aware" of the row/col number
     of the grid and can thus request the proper weather data for the location in the
     grid.
+
+    When a grid water balance is provided, the engine publishes the soil moisture
+    content (SM), the days since oxygen stress (DSOS) and the actual soil evaporation
+    (EVS) of its cell in the kiosk, so that the crop can run without a soil
+    `SimulationObject`.
     """
     row = Int
     col = Int
 
-    def __init__(self, row, col, **kwargs):
+    def __init__(self, row, col, waterbalance=None, **kwargs):
         self.row = int(row)
         self.col = int(col)
+        # PCSE engines only accept assignment of declared traits or private attributes
+        self._waterbalance = waterbalance
+        self._soil_variables = set()
         super().__init__(**kwargs)
 
+    def _publish_soil_variable(self, varname, vartype, value):
+        """Publishes a variable from the grid water balance in the kiosk.
+        """
+        if varname not in self._soil_variables:
+            self.kiosk.register_variable(id(self), varname, type=vartype, publish=True)
+            self._soil_variables.add(varname)
+        self.kiosk.set_variable(id(self), varname, float(value))
+
+    def integrate(self, day, delt):
+        # The crop accumulates the actual soil evaporation computed by the grid water balance
+        if self._waterbalance is not None:
+            self._publish_soil_variable("EVS", "R", self._waterbalance.EVS[self.row, self.col])
+        super().integrate(day, delt)
+
     # get driving variables needs to be redefined in order to take row/col into account
     def _get_driving_variables(self, day):
         """Get driving variables, compute derived properties and return it.
         """
         drv = self.weatherdataprovider(day, self.row, self.col)
 
+        # Soil states are flushed from the kiosk during integration and must be set again
+        if self._waterbalance is not None:
+            self._publish_soil_variable("SM", "S", self._waterbalance.SM[self.row, self.col])
+            self._publish_soil_variable("DSOS", "S", self._waterbalance.DSOS[self.row, self.col])
+
         # average temperature and average daytemperature (if needed)
         if not hasattr(drv, "TEMP"):
             drv.add_variable("TEMP", (drv.TMIN + drv.TMAX) / 2., "Celcius")
@@ -2,8 +2,13 @@
 # Copyright (c) 2019 Wageningeni Environmental Research, Wageningen-UR
 # Allard de Wit (allard.dewit@wur.nl), December 2019
 
+import os
 from pathlib import Path
 from itertools import product
+import multiprocessing
+import queue
+import traceback
+import logging
 import time
 import warnings
 warnings.filterwarnings("ignore")
@@ -14,11 +19,13 @@ from dotmap import DotMap
 import rasterio
 
 from pcse.fileinput import YAMLCropDataProvider
-from pcse.util import WOFOST71SiteDataProvider
+from pcse.util import WOFOST71SiteDataProvider, check_date
 from pcse.base import ParameterProvider
 
-from .dataproviders import WFLOWWeatherDataProvider, read_agromanagement
+from .dataproviders import WFLOWWeatherDataProvider, AgroManagementCache
 from .engine import GridAwareEngine
+from .waterbalance import GridWaterbalanceFD
+from .workers import GridWorker, split_grid
 
 
 def mm_to_cm(x):
@@ -32,6 +39,39 @@ def check_grid_size(conf, grid):
         raise RuntimeError
 
 
+def read_grid(conf, location):
+    """Reads the first band of a raster and replaces negative (nodata) values by NaN.
+    """
+    with rasterio.open(location) as ds:
+        # Convert to float first, integer rasters cannot hold NaN
+        grid = ds.read(1).astype(np.float64)
+        grid[grid < 0] = np.NaN
+        check_grid_size(conf, grid)
+    return grid
+
+
+def read_grid_coordinates(location):
+    """Returns the latitude of each row and the longitude of each column of a raster.
+
+    The raster must have a geographic (lat/lon) coordinate reference system.
+    """
+    with rasterio.open(location) as ds:
+        if ds.crs is None or not ds.crs.is_geographic:
+            msg = f"Raster {location} must have a geographic coordinate reference system, found: {ds.crs}"
+            raise RuntimeError(msg)
+        latitude = np.array(ds.xy(np.arange(ds.height), np.zeros(ds.height, dtype=int))[1])
+        longitude = np.array(ds.xy(np.zeros(ds.width, dtype=int), np.arange(ds.width))[0])
+    return latitude, longitude
+
+
+def grid_differs(old_grid, new_grid):
+    """Returns a boolean array which is True where the grids differ, NaN values compare equal.
+    """
+    old_grid = np.asarray(old_grid, dtype=np.float64)
+    new_grid = np.asarray(new_grid, dtype=np.float64)
+    return ~((old_grid == new_grid) | (np.isnan(old_grid) & np.isnan(new_grid)))
+
+
 def read_config_file(config_file):
     config_file = Path(config_file).resolve()
     if config_file.is_absolute():
@@ -58,67 +98,316 @@ class GriddedWOFOSTBMI:
     input_variables = {"Transpiration":  ("Actual crop transpiration", "mm/day", "TRA", mm_to_cm),
                        "PotTrans": ("Potential crop transpiration", "mm/day", "TRAMX", mm_to_cm),
                        }
+    production_levels = {"potential": "Wofost71_PP.conf",
+                         "water-limited": "Wofost71_WLP_GridFD.conf",
+                         }
+    # Soil parameters used for cells where no soil parameter map is defined
+    default_soil_parameters = {"SM0": 0.4, "SMFCF": 0.25, "SMW": 0.1, "CRAIRC": 0.04, "SOPE": 0.55, "KSUB": 0.37}
+    logger = logging.getLogger("griddedwofostbmi.GriddedWOFOSTBMI")
+    # Cells owned by this model when it runs inside a GridWorker, None for the whole grid
+    _cells = None
 
     def __init__(self, *args, **kwargs):
+        self._workers = []
         self.initialize(*args, **kwargs)
 
     def initialize(self, config_file="gridded_wofost.yaml"):
+        """Reads the configuration and input maps and builds the WOFOST engines.
+
+        With `runtime.processes` > 1 the grid is split in parts with the same number of
+        active cells, each part is built and owned by a worker process (see `GridWorker`).
+        The BMI methods are then dispatched to the workers, which run in parallel.
+        """
         t1 = time.time()
+        self._stop_workers()
+        self.config_file = config_file
         self.config = read_config_file(config_file)
+        # DotMap adds optional keys when they are read, keep the configuration as loaded
+        self._config_dict = self.config.toDict()
+
+        # Layer inputs for AgroManagement and soil
+        self._read_input_maps()
+        self.agromanagement = AgroManagementCache(self.config)
+
+        # Crop, site parameters
+        self.crop_parameters = YAMLCropDataProvider(fpath=self.config.crop_parameters.location)
+        self.site_parameters = WOFOST71SiteDataProvider(WAV=10, CO2=360)
+
+        # Weather from WFLOW NetCDF files, close files of a previous initialization
+        if getattr(self, "WFLOWWeatherDataProvider", None) is not None:
+            self.WFLOWWeatherDataProvider.close()
+        self.WFLOWWeatherDataProvider = self._create_weatherdataprovider(self.config)
+
+        # WOFOST configuration, water-limited production uses a water balance on the grid level
+        self.production_level = self.config.runtime.production_level or "potential"
+        if self.production_level not in self.production_levels:
+            msg = f"Unknown production level '{self.production_level}', " \
+                  f"should be one of {list(self.production_levels)}"
+            raise RuntimeError(msg)
+        self.wofost_config = str(Path(__file__).parent / "conf" / self.production_levels[self.production_level])
 
-        # Layer inputs for AgroManagement
-        with rasterio.open(self.config.maps.AEZ_map.location) as ds:
-            aez_map = ds.read(1)
-            aez_map[aez_map < 0] = np.NaN
-            check_grid_size(self.config, aez_map)
-        with rasterio.open(self.config.maps.crop_rotation_map.location) as ds:
-            crop_rotation_map = ds.read(1)
-            crop_rotation_map[crop_rotation_map < 0] = np.NaN
-            check_grid_size(self.config, crop_rotation_map)
-
-        # Crop, site parameters and soil grid
-        crop_parameters = YAMLCropDataProvider(fpath=self.config.crop_parameters.location)
-        site_parameters = WOFOST71SiteDataProvider(WAV=10, CO2=360)
-        with rasterio.open(self.config.maps.rooting_depth.location) as ds:
-            rooting_depth = ds.read(1)
-            rooting_depth[rooting_depth < 0] = np.NaN
-            check_grid_size(self.config, rooting_depth)
-
-        # Weather from WFLOW NetCDF files
-        self.WFLOWWeatherDataProvider = WFLOWWeatherDataProvider(self.config)
+        processes = int(self.config.runtime.processes or 1)
+        if processes > 1:
+            self._start_workers(processes)
+        else:
+            self._initialize_engines()
+        self.logger.info(f"Initializing {np.count_nonzero(self.active_mask)} cells took {time.time() - t1:.1f} seconds")
+
+    def _initialize_engines(self):
+        """Creates the grid water balance and builds the engines of all active cells.
+        """
+        active = self.active_mask = self._get_active_mask()
+        self.waterbalance = None
+        if self.production_level == "water-limited":
+            self.waterbalance = GridWaterbalanceFD(self._get_soil_grids(active), self.site_parameters, active)
 
         # initialize object grid for storing WOFOST results
-        self.WOFOSTgrid = np.ndarray(shape=aez_map.shape, dtype=np.object)
-
-        # WOFOST configuration
-        p = Path(__file__)
-        wofost_config = str(p.parent / "conf" / "Wofost71_PP.conf")
-
-        nrows, ncols = aez_map.shape
-        p_row = None
-        print("Initializing: .", end="")
-        for (row, col) in product(range(nrows), range(ncols)):
-            if row != p_row:
-                p_row = row
-                if row % 10 == 0:
-                    print(f"{row/float(nrows)*100:.1f}%..", end="")
-            if row == 15:
-                break
-            crop_rotation_type = crop_rotation_map[row, col]
-            aez = aez_map[row, col]
-            if crop_rotation_type not in self.config.maps.crop_rotation_map.relevant_crop_rotations:
-                continue
-            if aez not in self.config.maps.AEZ_map.relevant_AEZ:
-                continue
-            agro = read_agromanagement(self.config, aez, crop_rotation_type)
-            soil_parameters = {"RDMSOL": rooting_depth[row, col], "SM0": 0.4, "SMFCF": 0.25, "SMW": 0.1, "CRAIRC": 0.04}
-            params = ParameterProvider(sitedata=site_parameters, cropdata=crop_parameters, soildata=soil_parameters)
-            wofsim = GridAwareEngine(row=row, col=col, parameterprovider=params,
-                                     weatherdataprovider=self.WFLOWWeatherDataProvider,
-                                     agromanagement=agro, config=wofost_config)
-            self._check_start_end_date(wofsim, row, col, aez, crop_rotation_type)
-            self.WOFOSTgrid[row, col] = wofsim
-        print(f"\nInitializing took {time.time() - t1} seconds")
+        self.WOFOSTgrid = np.ndarray(shape=self.aez_map.shape, dtype=np.object)
+
+        self._build_engines(*np.nonzero(active))
+
+    def _start_workers(self, processes):
+        """Starts the worker processes which build and own the engines of their part of the grid.
+        """
+        self.active_mask = self._get_active_mask()
+        # The engines and water balance live in the workers, the grid of this process stays empty
+        self.waterbalance = None
+        self.WOFOSTgrid = np.ndarray(shape=self.aez_map.shape, dtype=np.object)
+
+        # Open weather files should not be shared with the worker processes
+        self.WFLOWWeatherDataProvider.close()
+        for cells in split_grid(self.active_mask, processes):
+            self._workers.append(GridWorker(len(self._workers), self, cells))
+        self.logger.info(f"Building engines in {len(self._workers)} worker processes")
+        try:
+            self._receive_from_workers()
+        except RuntimeError:
+            self._stop_workers()
+            raise
+
+    def _stop_workers(self):
+        """Stops the worker processes of a previous initialization.
+        """
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
+
+    def _call_workers(self, method, *args):
+        """Calls a method of the model in all workers, the workers run in parallel.
+
+        :return: list with the result of each worker
+        """
+        for worker in self._workers:
+            worker.send(method, *args)
+        return self._receive_from_workers()
+
+    def _receive_from_workers(self):
+        """Waits for the results of all workers and raises a RuntimeError if one of them failed.
+        """
+        # Always receive from all workers, so that the next call does not get an old result
+        replies = [worker.receive() for worker in self._workers]
+        for worker, (error, _) in zip(self._workers, replies):
+            if error is not None:
+                raise RuntimeError(f"Grid worker {worker.number} failed:\n{error}")
+        return [result for _, result in replies]
+
+    def reconfigure(self, config_file=None):
+        """Re-reads the configuration and input maps and rebuilds only the engines of the
+        cells whose inputs have changed.
+
+        A cell is rebuilt when its AEZ, crop rotation type, rooting depth or soil
+        parameters changed, when it became active or inactive, or when its agromanagement
+        file was modified on disk. Changes in the crop parameters, agromanagement location,
+        weather, grid definition or runtime require a full `initialize()`, which is done
+        automatically.
+
+        If the model was already running, the rebuilt engines are run together up to the
+        current day of the other engines. For potential production no WFLOW forcing is
+        available for this period, so the rebuilt cells use TRA = TRAMX = 1.0 (no water
+        stress) until the current day. For water-limited production the grid water balance
+        of the rebuilt cells restarts from its initial state and is run along with the
+        crops, so soil and crop state remain consistent.
+
+        With worker processes, each worker rebuilds the changed cells in its own part
+        of the grid.
+
+        :param config_file: the new configuration file, defaults to the configuration
+            file that was used for initialization.
+        """
+        t1 = time.time()
+        if config_file is None:
+            config_file = self.config_file
+        new_config = read_config_file(config_file)
+        if self._requires_initialize(new_config.toDict()):
+            self.initialize(config_file)
+            return
+
+        current_day = self.get_current_time()
+        if self._workers:
+            nchanged = sum(self._call_workers("_reconfigure", config_file, new_config, current_day))
+            self._set_config(config_file, new_config)
+            self.active_mask = self._get_active_mask()
+        else:
+            nchanged = self._reconfigure(config_file, new_config, current_day)
+        self.logger.info(f"Reconfiguring {nchanged} cells took {time.time() - t1:.1f} seconds")
+
+    def _set_config(self, config_file, config):
+        """Sets a new configuration and re-reads the input maps.
+        """
+        self.config_file = config_file
+        self.config = config
+        # DotMap adds optional keys when they are read, keep the configuration as loaded
+        self._config_dict = config.toDict()
+        self.agromanagement.config = config
+        self._read_input_maps()
+
+    def _reconfigure(self, config_file, config, current_day):
+        """Sets the new configuration and rebuilds the engines of the changed cells.
+
+        :param current_day: the day up to which the rebuilt engines are run, None if
+            the model is not running yet.
+        :return: the number of changed cells
+        """
+        old_maps = self._get_input_grids()
+        old_active = self._get_active_mask()
+        self._set_config(config_file, config)
+        active = self.active_mask = self._get_active_mask()
+
+        changed = (active != old_active)
+        for old_map, new_map in zip(old_maps, self._get_input_grids()):
+            changed |= active & grid_differs(old_map, new_map)
+        for aez, crop_rotation_type in self.agromanagement.refresh():
+            changed |= active & (self.aez_map == aez) & (self.crop_rotation_map == crop_rotation_type)
+        if self.waterbalance is not None:
+            self.waterbalance.reset(changed, self._get_soil_grids(active))
+
+        self.WOFOSTgrid[changed & ~active] = None
+        rows, cols = np.nonzero(changed & active)
+        self._build_engines(rows, cols)
+        self._run_engines_until(rows, cols, current_day)
+        return np.count_nonzero(changed)
+
+    def _requires_initialize(self, new_config_dict):
+        """Checks if the configuration changed in a way that affects all cells.
+
+        :param new_config_dict: the new configuration as a plain dict
+        """
+        old_config_dict = self._config_dict
+        if new_config_dict.get("maps", {}).get("metadata") != old_config_dict.get("maps", {}).get("metadata"):
+            return True
+        for section in ("crop_parameters", "agromanagement_definitions", "weather_variables", "runtime"):
+            if new_config_dict.get(section) != old_config_dict.get(section):
+                return True
+        return False
+
+    def _run_engines_until(self, rows, cols, current_day):
+        """Runs the engines of the given cells up to current_day.
+
+        The engines are advanced together one day at a time, so that the weather of each
+        day is read only once.
+        """
+        engines = [self.WOFOSTgrid[row, col] for row, col in zip(rows, cols)]
+        if current_day is None or not engines or engines[0].day >= current_day:
+            return
+
+        day = engines[0].day
+        if self.production_level == "potential":
+            self.logger.warning(f"Running {len(engines)} rebuilt cells from {day} to {current_day} "
+                                f"without WFLOW forcing, using TRA = TRAMX = 1.0 for this period.")
+        mask = np.zeros(self.WOFOSTgrid.shape, dtype=bool)
+        mask[rows, cols] = True
+        while day < current_day:
+            if self.waterbalance is not None:
+                self._update_waterbalance(day, rows, cols, mask=mask)
+            for wofsim in engines:
+                wofsim.run()
+            day = engines[0].day
+
+    def _read_input_maps(self):
+        """Reads the AEZ, crop rotation, rooting depth and soil parameter maps.
+        """
+        self.aez_map = read_grid(self.config, self.config.maps.AEZ_map.location)
+        self.crop_rotation_map = read_grid(self.config, self.config.maps.crop_rotation_map.location)
+        self.rooting_depth = read_grid(self.config, self.config.maps.rooting_depth.location)
+        self.soil_maps = {}
+        for name, section in self.config.maps.soil_parameters.items():
+            soil_map = read_grid(self.config, section.location)
+            nodata = np.isnan(soil_map)
+            if nodata.any():
+                self.logger.warning(f"Soil parameter map for {name} has {np.count_nonzero(nodata)} nodata "
+                                    f"cells, using default value {self.default_soil_parameters[name]} there.")
+                soil_map[nodata] = self.default_soil_parameters[name]
+            self.soil_maps[name] = soil_map
+
+    def _get_soil_grids(self, mask):
+        """Returns a grid for each soil parameter with NaN outside of mask.
+
+        Soil parameters without a map are filled with their default value.
+        """
+        soil_grids = {"RDMSOL": np.where(mask, self.rooting_depth, np.NaN)}
+        for name, default_value in self.default_soil_parameters.items():
+            grid = self.soil_maps.get(name, default_value)
+            soil_grids[name] = np.where(mask, grid, np.NaN)
+        return soil_grids
+
+    def _get_input_grids(self):
+        """Returns the list of input grids that determine the engine of a cell.
+        """
+        soil_grids = self._get_soil_grids(np.ones(self.aez_map.shape, dtype=bool))
+        return [self.aez_map, self.crop_rotation_map] + [soil_grids[name] for name in sorted(soil_grids)]
+
+    def _get_active_mask(self):
+        """Returns a boolean array which is True for cells that need a WOFOST simulation.
+        """
+        relevant_crop_rotations = self.config.maps.crop_rotation_map.relevant_crop_rotations
+        relevant_AEZ = self.config.maps.AEZ_map.relevant_AEZ
+        active = np.isin(self.crop_rotation_map, relevant_crop_rotations) & np.isin(self.aez_map, relevant_AEZ)
+        if self._cells is not None:
+            active &= self._cells
+        return active
+
+    def _build_engines(self, rows, cols):
+        """Builds the WOFOST engines for the given cells and stores them in the grid.
+
+        The start/end date only depend on the agromanagement, they are therefore checked
+        once for each combination of AEZ and crop rotation type.
+
+        :param rows: array with row numbers of the cells
+        :param cols: array with column numbers of the cells
+        """
+        aez = self.aez_map[rows, cols].astype(int)
+        crop_rotation_type = self.crop_rotation_map[rows, cols].astype(int)
+        soil_grids = self._get_soil_grids(np.ones(self.aez_map.shape, dtype=bool))
+        soil_parameters = {name: grid[rows, cols] for name, grid in soil_grids.items()}
+
+        checked = set()
+        ncells = len(rows)
+        progress_interval = max(1, ncells // 10)
+        for i in range(ncells):
+            key = (aez[i], crop_rotation_type[i])
+            cell_soil_parameters = {name: values[i] for name, values in soil_parameters.items()}
+            wofsim = self._build_engine(rows[i], cols[i], key, cell_soil_parameters)
+            if key not in checked:
+                self._check_start_end_date(wofsim, rows[i], cols[i], *key)
+                checked.add(key)
+            self.WOFOSTgrid[rows[i], cols[i]] = wofsim
+            if (i + 1) % progress_interval == 0:
+                self.logger.info(f"Building engines: {(i + 1)/ncells*100:.1f}%")
+
+    def _build_engine(self, row, col, key, soil_parameters):
+        """Builds the WOFOST engine for given row/col.
+
+        :param key: tuple with the AEZ and crop rotation type of the cell
+        :param soil_parameters: dict with the soil parameters of the cell
+        """
+        agro = self.agromanagement(*key)
+        params = ParameterProvider(sitedata=self.site_parameters, cropdata=self.crop_parameters,
+                                   soildata=soil_parameters)
+        wofsim = GridAwareEngine(row=row, col=col, parameterprovider=params,
+                                 weatherdataprovider=self.WFLOWWeatherDataProvider,
+                                 agromanagement=agro, config=self.wofost_config,
+                                 waterbalance=self.waterbalance)
+        return wofsim
 
     def _check_start_end_date(self, wofsim, row, col, aez, crop_rotation_type):
         """Checks the start/end date of a given model instance with the global configuration
@@ -136,24 +425,184 @@ class GriddedWOFOSTBMI:
             raise RuntimeError(msg)
 
     def update(self):
+        if self._workers:
+            self._call_workers("update")
+            return
+        if self.waterbalance is not None:
+            self._update_waterbalance(self.get_current_time(), *np.nonzero(self.active_mask))
         for wofsim in self.WOFOSTgrid.flatten():
             if wofsim is not None:
                 wofsim.run()
 
-    def get_current_time(self):
+    def _update_waterbalance(self, day, rows, cols, mask=None):
+        """Computes the grid water balance for given day from the crop rates of the given cells.
+
+        :param mask: if given, only the water balance of the cells in mask is updated.
+        """
+        wdp = self.WFLOWWeatherDataProvider
+        self.waterbalance.update(RAIN=wdp.get_layer(day, "RAIN"),
+                                 E0=wdp.get_layer(day, "E0"),
+                                 ES0=wdp.get_layer(day, "ES0"),
+                                 mask=mask,
+                                 **self._get_crop_rates(rows, cols))
+
+    def _get_crop_rates(self, rows, cols):
+        """Returns a grid for each crop rate used by the grid water balance, NaN if not available.
+
+        The rates are collected in a single pass over the given cells.
+        """
+        crop_rates = {varname: np.full(self.WOFOSTgrid.shape, dtype=np.float64, fill_value=np.NaN)
+                      for varname in ("TRA", "EVWMX", "EVSMX", "RD")}
+        for row, col in zip(rows, cols):
+            wofsim = self.WOFOSTgrid[row, col]
+            for varname, dest_array in crop_rates.items():
+                value = wofsim.get_variable(varname)
+                if value is not None:
+                    dest_array[row, col] = value
+        return crop_rates
+
+    def fork(self, branches, output_variables=("LAI",), until=None, processes=None):
+        """Runs forecast scenario branches starting from the current state of the grid.
+
+        Each branch runs in a worker process created with `os.fork()`, so the state of
+        all engines (and the grid water balance) is shared copy-on-write and the history
+        up to the current day is not simulated again. Outputs are streamed back while
+        the branches are running.
+
+        A branch is a dict with the optional keys:
+
+         - "weather": a weather location (file, glob pattern or list of files) or a
+           `WFLOWWeatherDataProvider` to be used by the branch.
+         - "forcing": a callable `forcing(model, day)` which is called before each
+           update, for example to set Transpiration/PotTrans with `set_value()`.
+
+        :param branches: list of branch definitions
+        :param output_variables: the BMI output variables to send back each day
+        :param until: the last day to simulate, defaults to the end time of the model
+        :param processes: maximum number of branches running at the same time,
+            defaults to the number of CPUs.
+        :return: a generator yielding (branch_number, day, {varname: array}) tuples
+        """
+        # Checks are done here, the generator below only starts running on the first next()
+        if not hasattr(os, "fork"):
+            raise RuntimeError("Forking the grid state requires os.fork() which is not available on this platform!")
+        if self._workers:
+            raise RuntimeError("Forking the grid state is not supported when the engines are owned by "
+                               "worker processes (runtime.processes > 1)!")
+        for varname in output_variables:
+            if varname not in self.output_variables:
+                raise RuntimeError(f"'{varname}' not defined as a BMI output variable!")
+        end_time = self.get_end_time()
+        until = end_time if until is None else min(check_date(until), end_time)
+        processes = processes or os.cpu_count()
+
+        # Open weather files should not be shared with the worker processes
+        self.WFLOWWeatherDataProvider.close()
+        for branch in branches:
+            if hasattr(branch.get("weather"), "close"):
+                branch["weather"].close()
+
+        return self._run_branches(branches, output_variables, until, processes)
+
+    def _run_branches(self, branches, output_variables, until, processes):
+        """Generator that starts the forked workers and yields their outputs.
+        """
+        ctx = multiprocessing.get_context("fork")
+        results = ctx.Queue()
+        pending = list(enumerate(branches))
+        running = {}
+        try:
+            while pending or running:
+                while pending and len(running) < processes:
+                    branch_number, branch = pending.pop(0)
+                    worker = ctx.Process(target=self._run_branch,
+                                         args=(branch_number, branch, output_variables, until, results))
+                    worker.start()
+                    running[branch_number] = worker
+
+                try:
+                    branch_number, day, outputs = results.get(timeout=1.0)
+                except queue.Empty:
+                    # A worker that exits without its last message was killed (e.g. out of memory)
+                    for branch_number, worker in running.items():
+                        if worker.exitcode is not None and worker.exitcode != 0:
+                            msg = f"Forecast branch {branch_number} died with exit code {worker.exitcode}!"
+                            raise RuntimeError(msg)
+                    continue
+
+                if day is None:
+                    # Last message of a branch, outputs contains the traceback if the branch failed
+                    running.pop(branch_number).join()
+                    if outputs is not None:
+                        raise RuntimeError(f"Forecast branch {branch_number} failed:\n{outputs}")
+                    continue
+                yield branch_number, day, outputs
+        finally:
+            for worker in running.values():
+                worker.terminate()
+                worker.join()
+
+    def _run_branch(self, branch_number, branch, output_variables, until, results):
+        """Runs a single forecast branch inside a forked worker process.
+        """
+        try:
+            weather = branch.get("weather")
+            if weather is not None:
+                if isinstance(weather, (str, list, tuple)):
+                    config = DotMap(self.config.toDict())
+                    config.weather_variables.location = weather
+                    weather = self._create_weatherdataprovider(config)
+                self._set_weatherdataprovider(weather)
+            forcing = branch.get("forcing")
+
+            day = self.get_current_time()
+            while day < until:
+                if forcing is not None:
+                    forcing(self, day)
+                self.update()
+                day = self.get_current_time()
+                outputs = {varname: self.get_value(varname) for varname in output_variables}
+                results.put((branch_number, day, outputs))
+            results.put((branch_number, None, None))
+        except Exception:
+            results.put((branch_number, None, traceback.format_exc()))
+
+    def _create_weatherdataprovider(self, config):
+        """Creates the weather data provider, the AEZ map defines the coordinates of the model grid.
+        """
+        if config.weather_variables.grid_mapping != "nearest":
+            return WFLOWWeatherDataProvider(config)
+        grid_latitude, grid_longitude = read_grid_coordinates(config.maps.AEZ_map.location)
+        return WFLOWWeatherDataProvider(config, grid_latitude, grid_longitude)
+
+    def _set_weatherdataprovider(self, weatherdataprovider):
+        """Replaces the weather data provider of the model and all engines.
+        """
+        self.WFLOWWeatherDataProvider = weatherdataprovider
         for wofsim in self.WOFOSTgrid.flatten():
             if wofsim is not None:
-                return wofsim.day
+                wofsim.weatherdataprovider = weatherdataprovider
 
-    def get_start_time(self):
+    def _get_engine_attribute(self, name):
+        """Returns an attribute of the first engine, all engines run on the same dates.
+        """
+        if self._workers:
+            for value in self._call_workers("_get_engine_attribute", name):
+                if value is not None:
+                    return value
+            return None
         for wofsim in self.WOFOSTgrid.flatten():
             if wofsim is not None:
-                return wofsim.start_date
+                return getattr(wofsim, name)
+
+    def get_current_time(self):
+        return self._get_engine_attribute("day")
+
+    def get_start_time(self):
+        return self._get_engine_attribute("start_date")
 
     def get_end_time(self):
-        for wofsim in self.WOFOSTgrid.flatten():
-            if wofsim is not None:
-                return wofsim.end_date
+        return self._get_engine_attribute("end_date")
 
     def get_time_step(self):
         return 1.0
@@ -178,6 +627,21 @@ class GriddedWOFOSTBMI:
         if varname not in self.output_variables:
             raise RuntimeError(f"'{varname}' not defined as a BMI output variable!")
 
+        if self._workers:
+            dest_array = np.full(self.WOFOSTgrid.shape, dtype=np.float64, fill_value=np.NaN)
+            for worker, values in zip(self._workers, self._call_workers("_get_values", varname)):
+                dest_array[worker.cells] = values[worker.cells]
+        else:
+            dest_array = self._get_values(varname)
+
+        if self.config.model_output.flip_output_array:
+            return np.flipud(dest_array)
+        else:
+            return dest_array
+
+    def _get_values(self, varname):
+        """Returns the values of a WOFOST variable for the whole grid, NaN for inactive cells.
+        """
         # Destination array for WOFOST output variable.
         dest_array = np.full_like(self.WOFOSTgrid, dtype=np.float64, fill_value=np.NaN)
 
@@ -193,10 +657,7 @@ class GriddedWOFOSTBMI:
             else:
                 dest_array[row, col] = value
 
-        if self.config.model_output.flip_output_array:
-            return np.flipud(dest_array)
-        else:
-            return dest_array
+        return dest_array
 
     def set_value(self, varname, value_array):
 
@@ -210,6 +671,10 @@ class GriddedWOFOSTBMI:
             self.logger.error(msg)
             raise RuntimeError(msg)
 
+        if self._workers:
+            self._call_workers("set_value", varname, value_array)
+            return
+
         WOFOST_varname = self.input_variables[varname][2]
         conversion = self.input_variables[varname][3]
 
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 Wageningeni Environmental Research, Wageningen-UR
+# Allard de Wit (allard.dewit@wur.nl), December 2019
+import numpy as np
+
+
+class GridWaterbalanceFD:
+    """Water balance for freely draining soils computed for all cells of the grid at once.
+
+    This implements the logic of the PCSE `WaterbalanceFD` but holds the states and rates
+    as grid-wide arrays that are updated in one vectorized step. The crop in each cell
+    obtains its soil moisture content (SM) from this object and provides the crop
+    transpiration (TRA), maximum evaporation rates (EVWMX, EVSMX) and rooting depth (RD)
+    in return. Cells without a crop use the potential evaporation rates and the default
+    rooting depth.
+
+    Differences with the PCSE `WaterbalanceFD`: the redistribution of water due to root
+    growth is done with the rooting depth of the previous day and the maximum rooting
+    depth is taken as the maximum of RD and RDMSOL. Irrigation is not supported.
+
+    **Soil parameters** (grids): SM0, SMFCF, SMW, CRAIRC, RDMSOL, SOPE, KSUB
+
+    **Site parameters** (scalars): IFUNRN, NOTINF, SSI, SSMAX, WAV, SMLIM
+    """
+    DEFAULT_RD = 10.
+    soil_parameter_names = ("SM0", "SMFCF", "SMW", "CRAIRC", "RDMSOL", "SOPE", "KSUB")
+    site_parameter_names = ("IFUNRN", "NOTINF", "SSI", "SSMAX", "WAV", "SMLIM")
+    variable_names = ("SM", "W", "WLOW", "SS", "DSLR", "RDold", "RINold", "DSOS", "TRA", "EVS", "EVW",
+                      "RIN", "PERC", "LOSS", "DW", "DWLOW", "_RAIN", "_RD")
+
+    def __init__(self, soil_parameters, site_parameters, mask):
+        """
+        :param soil_parameters: dict with a grid for each of the soil parameters
+        :param site_parameters: `SiteDataProvider` or dict with the site parameters
+        :param mask: boolean array which is True for cells to be simulated.
+        """
+        shape = mask.shape
+        self.site = {name: float(site_parameters[name]) for name in self.site_parameter_names}
+        self.params = {name: np.full(shape, np.NaN) for name in self.soil_parameter_names}
+
+        # States
+        self.SM = np.full(shape, np.NaN)
+        self.W = np.full(shape, np.NaN)
+        self.WLOW = np.full(shape, np.NaN)
+        self.SS = np.full(shape, np.NaN)
+        self.DSLR = np.full(shape, np.NaN)
+        self.RDold = np.full(shape, np.NaN)
+        self.RINold = np.full(shape, np.NaN)
+        self.DSOS = np.full(shape, np.NaN)
+
+        # Rates
+        self.TRA = np.zeros(shape)
+        self.EVS = np.zeros(shape)
+        self.EVW = np.zeros(shape)
+        self.RIN = np.zeros(shape)
+        self.PERC = np.zeros(shape)
+        self.LOSS = np.zeros(shape)
+        self.DW = np.zeros(shape)
+        self.DWLOW = np.zeros(shape)
+        self._RAIN = np.zeros(shape)
+        self._RD = np.full(shape, self.DEFAULT_RD)
+
+        self.reset(mask, soil_parameters)
+
+    def reset(self, mask, soil_parameters):
+        """Sets the parameters and initial states for the cells in mask.
+
+        :param mask: boolean array which is True for cells to be (re)initialized.
+        :param soil_parameters: dict with a grid for each of the soil parameters
+        """
+        for name in self.soil_parameter_names:
+            self.params[name][mask] = soil_parameters[name][mask]
+        SM0, SMFCF, SMW, RDMSOL = [self.params[name][mask] for name in ("SM0", "SMFCF", "SMW", "RDMSOL")]
+        s = self.site
+
+        SMLIM = np.clip(s["SMLIM"], SMW, SM0)
+        RD = self.DEFAULT_RD
+        RDM = np.maximum(RD, RDMSOL)
+
+        # Initial soil moisture content and amount of water in rooted zone, limited by SMLIM
+        SM = np.clip(SMW + s["WAV"]/RD, SMW, SMLIM)
+        W = SM * RD
+        # Initial amount of soil moisture between current root zone and maximum rootable depth
+        WLOW = np.clip(s["WAV"] + RDM*SMW - W, 0., SM0*(RDM - RD))
+
+        self.SM[mask] = SM
+        self.W[mask] = W
+        self.WLOW[mask] = WLOW
+        self.SS[mask] = s["SSI"]
+        self.DSLR[mask] = np.where(SM >= (SMW + 0.5*(SMFCF - SMW)), 1., 5.)
+        self.RDold[mask] = RD
+        self.RINold[mask] = 0.
+        self.DSOS[mask] = 0.
+        self.EVS[mask] = 0.
+        self.EVW[mask] = 0.
+
+    def update(self, RAIN, E0, ES0, TRA, EVWMX, EVSMX, RD, mask=None):
+        """Computes the rates and integrates the states for one day.
+
+        :param mask: if given, only the cells in mask are updated, the other cells keep
+            their current states and rates.
+        """
+        if mask is not None:
+            previous = {name: getattr(self, name).copy() for name in self.variable_names}
+        self.calc_rates(RAIN, E0, ES0, TRA, EVWMX, EVSMX, RD)
+        self.integrate()
+        if mask is not None:
+            for name, values in previous.items():
+                updated = np.array(getattr(self, name), dtype=np.float64)
+                updated[~mask] = values[~mask]
+                setattr(self, name, updated)
+
+    def calc_rates(self, RAIN, E0, ES0, TRA, EVWMX, EVSMX, RD):
+        """Computes the water balance rates for all cells.
+
+        Crop variables (TRA, EVWMX, EVSMX, RD) are NaN for cells without a crop.
+
+        :param RAIN: grid with rainfall [cm/day]
+        :param E0: grid with potential evaporation from a free water surface [cm/day]
+        :param ES0: grid with potential evaporation from a bare soil surface [cm/day]
+        :param TRA: grid with crop transpiration [cm/day]
+        :param EVWMX: grid with maximum evaporation from a water surface below the canopy [cm/day]
+        :param EVSMX: grid with maximum evaporation from a soil surface below the canopy [cm/day]
+        :param RD: grid with rooting depth [cm]
+        """
+        p = self.params
+        s = self.site
+
+        with np.errstate(invalid="ignore"):
+            # Without crop transpiration use the potential soil/water evaporation rates
+            no_crop = np.isnan(TRA)
+            self.TRA = np.where(no_crop, 0., TRA)
+            EVWMX = np.where(no_crop, E0, EVWMX)
+            EVSMX = np.where(no_crop, ES0, EVSMX)
+            RD = np.where(np.isnan(RD), self.DEFAULT_RD, RD)
+            RDM = np.maximum(RD, p["RDMSOL"])
+
+            # Actual evaporation rates, from the water layer if surface storage > 1cm,
+            # otherwise from the soil surface as a function of days since last rain (DSLR)
+            surface_water = self.SS > 1.
+            infiltrated = self.RINold >= 1.
+            self.DSLR = np.where(surface_water, self.DSLR, np.where(infiltrated, 1., self.DSLR + 1.))
+            EVSMXT = EVSMX * (np.sqrt(self.DSLR) - np.sqrt(self.DSLR - 1.))
+            EVS = np.where(infiltrated, EVSMX, np.minimum(EVSMX, EVSMXT + self.RINold))
+            self.EVW = np.where(surface_water, EVWMX, 0.)
+            self.EVS = np.where(surface_water, 0., EVS)
+
+            # Preliminary infiltration rate, possibly as function of storm size (NINFTB)
+            if s["IFUNRN"] == 0:
+                RINPRE = (1. - s["NOTINF"]) * RAIN
+            else:
+                NINF = np.interp(RAIN, [0.0, 0.5, 1.5], [0.0, 0.0, 1.0])
+                RINPRE = (1. - s["NOTINF"] * NINF) * RAIN
+            # with surface storage, infiltration limited by SOPE
+            RINPRE = RINPRE + self.SS
+            AVAIL = RINPRE - self.EVW
+            RINPRE = np.where(self.SS > 0.1, np.minimum(p["SOPE"], AVAIL), RINPRE)
+
+            # percolation from rootzone to subsoil equals amount of excess moisture
+            # in rootzone, not to exceed maximum percolation rate of root zone (SOPE)
+            WE = p["SMFCF"] * RD
+            PERC1 = np.clip((self.W - WE) - self.TRA - self.EVS, 0., p["SOPE"])
+
+            # loss of water at the lower end of the maximum root zone
+            WELOW = p["SMFCF"] * (RDM - RD)
+            self.LOSS = np.clip(self.WLOW - WELOW + PERC1, 0., p["KSUB"])
+            # percolation not to exceed uptake capacity of subsoil
+            PERC2 = ((RDM - RD) * p["SM0"] - self.WLOW) + self.LOSS
+            self.PERC = np.minimum(PERC1, PERC2)
+
+            # adjustment of infiltration rate
+            self.RIN = np.minimum(RINPRE, (p["SM0"] - self.SM)*RD + self.TRA + self.EVS + self.PERC)
+            self.RINold = self.RIN
+
+            # rates of change in amounts of moisture W and WLOW
+            self.DW = self.RIN - self.TRA - self.EVS - self.PERC
+            self.DWLOW = self.PERC - self.LOSS
+
+        self._RAIN = RAIN
+        self._RD = RD
+
+    def integrate(self, delt=1.0):
+        """Integrates the water balance states for all cells.
+        """
+        p = self.params
+        RD = self._RD
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            # amount of water in rooted zone, if negative correct the soil evaporation
+            W = self.W + self.DW * delt
+            self.EVS = np.where(W < 0., self.EVS + W, self.EVS)
+            self.W = np.maximum(W, 0.)
+
+            # change of surface storage
+            SSPRE = self.SS + (self._RAIN - self.EVW - self.RIN) * delt
+            self.SS = np.minimum(SSPRE, self.site["SSMAX"])
+
+            # amount of water in the zone between the rooted zone and the maximum rooting depth
+            self.WLOW = self.WLOW + self.DWLOW * delt
+
+            # Change of rootzone subsystem boundary: growing roots add soil moisture from
+            # below to the rootzone, decreasing roots 'lose' soil moisture to the lower zone.
+            RDM = np.maximum(RD, p["RDMSOL"])
+            RDchange = RD - self.RDold
+            WDR = np.where(RDchange > 0.001,
+                           np.minimum(self.WLOW, self.WLOW * RDchange/(RDM - self.RDold)),
+                           self.W * RDchange/self.RDold)
+            self.WLOW = self.WLOW - WDR
+            self.W = self.W + WDR
+
+            # mean soil moisture content in rooted zone
+            self.SM = self.W/RD
+            self.RDold = RD
+
+            # days since oxygen stress, the soil is saturated up to the critical air content
+            self.DSOS = np.where(self.SM >= (p["SM0"] - p["CRAIRC"]), self.DSOS + 1., 0.)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 Wageningeni Environmental Research, Wageningen-UR
+# Allard de Wit (allard.dewit@wur.nl), December 2019
+import multiprocessing
+import traceback
+
+import numpy as np
+
+
+def split_grid(active, nparts):
+    """Splits the grid into contiguous parts with (nearly) the same number of active cells.
+
+    Every cell of the grid belongs to exactly one part, so that cells which become active
+    later on also have an owner.
+
+    :param active: boolean array which is True for cells that need a WOFOST simulation.
+    :param nparts: the number of parts, reduced to the number of active cells if needed.
+    :return: a list of boolean arrays, one for each part
+    """
+    cell_numbers = np.flatnonzero(active)
+    nparts = max(1, min(nparts, len(cell_numbers)))
+    chunks = np.array_split(cell_numbers, nparts)
+    bounds = [0] + [chunk[0] for chunk in chunks[1:]] + [active.size]
+    flat_index = np.arange(active.size).reshape(active.shape)
+    return [(flat_index >= lower) & (flat_index < upper) for lower, upper in zip(bounds[:-1], bounds[1:])]
+
+
+class GridWorker:
+    """Worker process that builds and owns the engines of a part of the grid.
+
+    The worker is created with `os.fork()`, so it starts with a copy of the model including
+    its configuration, input maps and data providers. In the worker, the model is restricted
+    to the cells of its part, it builds the engines (and grid water balance) of these cells
+    and then executes the method calls it receives from the model in the main process.
+    PCSE engines cannot be pickled, so they never leave the worker; only arguments and
+    results such as arrays and dates are sent through the pipe.
+    """
+
+    def __init__(self, number, model, cells):
+        """
+        :param number: the number of the worker, used in error messages
+        :param model: the GriddedWOFOSTBMI instance to be forked
+        :param cells: boolean array which is True for the cells owned by this worker
+        """
+        self.number = number
+        self.cells = cells
+        ctx = multiprocessing.get_context("fork")
+        self._connection, worker_connection = ctx.Pipe()
+        self.process = ctx.Process(target=self._serve, args=(model, worker_connection), daemon=True)
+        self.process.start()
+        worker_connection.close()
+
+    def _serve(self, model, connection):
+        """Builds the engines and executes method calls, runs inside the worker process.
+        """
+        # Only the main process talks to the workers
+        self._connection.close()
+        for worker in model._workers:
+            worker._connection.close()
+        model._workers = []
+
+        model._cells = self.cells
+        try:
+            model._initialize_engines()
+            connection.send((None, None))
+        except Exception:
+            connection.send((traceback.format_exc(), None))
+            return
+
+        while True:
+            try:
+                method, args = connection.recv()
+            except EOFError:
+                # The main process closed the connection
+                break
+            try:
+                connection.send((None, getattr(model, method)(*args)))
+            except Exception:
+                connection.send((traceback.format_exc(), None))
+
+    def send(self, method, *args):
+        """Requests the worker to call a method of its model with given arguments.
+        """
+        self._connection.send((method, args))
+
+    def receive(self):
+        """Waits for the result of the last request.
+
+        :return: a tuple (error, result), error contains the traceback if the call failed.
+        """
+        try:
+            return self._connection.recv()
+        except EOFError:
+            return f"Grid worker {self.number} died with exit code {self.process.exitcode}!", None
+
+    def close(self):
+        """Stops the worker process.
+        """
+        self._connection.close()
+        self.process.join(timeout=5.)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
@@ -45,7 +45,7 @@ if __name__ == "__main__":
     pottrans = np.ones_like(template_array)
 
     # Template dataset
-    meteo_ds = xr.open_dataset(g.config.weather_variables.location)
+    meteo_ds = xr.open_dataset(g.WFLOWWeatherDataProvider.files[0])
 
     # Get initial values
     day = g.get_current_time()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 Wageningeni Environmental Research, Wageningen-UR
+# Allard de Wit (allard.dewit@wur.nl), December 2019
+"""Fixtures for a small synthetic grid: input maps, WFLOW weather, agromanagement
+and a configuration file pointing to them.
+"""
+import shutil
+import datetime as dt
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+import yaml
+import rasterio
+from rasterio.transform import from_origin
+import pytest
+
+DATA_DIR = Path(__file__).parent / "data"
+
+START_DATE = dt.date(2010, 3, 1)
+END_DATE = dt.date(2010, 8, 31)
+# Grid of 3 rows by 4 columns, 0.1 degree cells
+WEST, NORTH, CELLSIZE = 5.0, 50.0, 0.1
+AEZ_MAP = [[1, 1, 1, 1],
+           [1, 1, 1, 1],
+           [1, 1, 1, -9999]]
+CROP_ROTATION_MAP = [[1, 1, 2, 2],
+                     [1, 1, 2, 2],
+                     [1, 2, 3, 1]]
+# crop rotation type 2 emerges two weeks later than type 1
+CROP_START_DATES = {1: dt.date(2010, 3, 15), 2: dt.date(2010, 3, 29)}
+
+AGROMANAGEMENT = """AgroManagement:
+- {start_date}:
+    CropCalendar:
+        crop_name: wheat
+        variety_name: Winter_wheat_102
+        crop_start_date: {crop_start_date}
+        crop_start_type: emergence
+        crop_end_date: 2010-08-15
+        crop_end_type: harvest
+        max_duration: 300
+    TimedEvents: null
+    StateEvents: null
+- {end_date}:
+"""
+
+
+def write_grid(fname, values):
+    """Writes a single band GeoTIFF on the test grid.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    with rasterio.open(fname, "w", driver="GTiff", height=values.shape[0], width=values.shape[1],
+                       count=1, dtype="float32", crs="EPSG:4326",
+                       transform=from_origin(WEST, NORTH, CELLSIZE, CELLSIZE)) as ds:
+        ds.write(values, 1)
+
+
+def write_agromanagement(location, aez, crop_rotation_type, crop_start_date):
+    """Writes the agromanagement file for given AEZ and crop rotation type.
+    """
+    fname = Path(location) / f"AEZ_{aez:03d}" / f"rotation_type_{crop_rotation_type:02d}.yaml"
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    fname.write_text(AGROMANAGEMENT.format(start_date=START_DATE, end_date=END_DATE,
+                                           crop_start_date=crop_start_date))
+    return fname
+
+
+def write_weather(fname, nrows, ncols):
+    """Writes a WFLOW NetCDF weather file covering the simulation period.
+    """
+    time = pd.date_range(START_DATE, END_DATE + dt.timedelta(days=1), freq="D")
+    latitude = NORTH - CELLSIZE/2. - CELLSIZE * np.arange(nrows)
+    longitude = WEST + CELLSIZE/2. + CELLSIZE * np.arange(ncols)
+    doy = time.dayofyear.values[:, None, None]
+    rng = np.random.default_rng(42)
+    shape = (len(time), nrows, ncols)
+    TEMP = 12. + 8. * np.sin((doy - 100.) / 365. * 2. * np.pi) + np.zeros(shape)
+    PET = 1. + 3. * np.clip(np.sin((doy - 80.) / 365. * 2. * np.pi), 0., None) + np.zeros(shape)
+    P = np.where(rng.random(shape) < 0.3, rng.gamma(2., 6., shape), 0.)
+    dims = ("time", "lat", "lon")
+    ds = xr.Dataset({"TEMP": (dims, TEMP), "PET": (dims, PET), "P": (dims, P)},
+                    coords={"time": time, "lat": latitude, "lon": longitude})
+    ds.to_netcdf(fname)
+
+
+@pytest.fixture
+def make_config(tmp_path):
+    """Returns a function that writes the test inputs and a configuration file.
+
+    Keyword arguments update the corresponding sections of the configuration.
+    """
+    nrows, ncols = np.shape(AEZ_MAP)
+    write_grid(tmp_path / "aez.tif", AEZ_MAP)
+    write_grid(tmp_path / "crop_rotation.tif", CROP_ROTATION_MAP)
+    write_grid(tmp_path / "rooting_depth.tif", np.full((nrows, ncols), 120.))
+    write_weather(tmp_path / "weather.nc", nrows, ncols)
+    for crop_rotation_type, crop_start_date in CROP_START_DATES.items():
+        write_agromanagement(tmp_path / "agromanagement", 1, crop_rotation_type, crop_start_date)
+    # YAMLCropDataProvider writes a cache file next to the YAML files
+    shutil.copytree(DATA_DIR / "crop_parameters", tmp_path / "crop_parameters")
+
+    def _make_config(production_level="potential", fname="gridded_wofost.yaml", **sections):
+        config = {
+            "GriddedWOFOSTBMI": {"version": 0.1},
+            "maps": {
+                "metadata": {"nrows": nrows, "ncols": ncols},
+                "AEZ_map": {"location": str(tmp_path / "aez.tif"), "relevant_AEZ": [1]},
+                "crop_rotation_map": {"location": str(tmp_path / "crop_rotation.tif"),
+                                      "relevant_crop_rotations": [1, 2]},
+                "rooting_depth": {"location": str(tmp_path / "rooting_depth.tif")},
+            },
+            "crop_parameters": {"location": str(tmp_path / "crop_parameters")},
+            "agromanagement_definitions": {"location": str(tmp_path / "agromanagement")},
+            "weather_variables": {"location": str(tmp_path / "weather.nc")},
+            "runtime": {"start_date": START_DATE, "end_date": END_DATE,
+                        "production_level": production_level},
+            "model_output": {"flip_output_array": False},
+        }
+        for section, values in sections.items():
+            config[section].update(values)
+        config_file = tmp_path / fname
+        config_file.write_text(yaml.safe_dump(config))
+        return config_file
+
+    return _make_config
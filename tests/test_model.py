@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 Wageningeni Environmental Research, Wageningen-UR
+# Allard de Wit (allard.dewit@wur.nl), December 2019
+import os
+import datetime as dt
+
+import numpy as np
+import pytest
+
+from griddedwofostbmi.model import GriddedWOFOSTBMI
+from griddedwofostbmi.engine import GridAwareEngine
+
+from conftest import START_DATE, CROP_ROTATION_MAP, CROP_START_DATES, write_grid, write_agromanagement
+
+
+@pytest.mark.parametrize("production_level", ["potential", "water-limited"])
+def test_engines_build_and_run(make_config, production_level):
+    g = GriddedWOFOSTBMI(make_config(production_level))
+
+    # AEZ nodata and crop rotation type 3 are not simulated
+    expected_active = np.array([[1, 1, 1, 1], [1, 1, 1, 1], [1, 1, 0, 0]], dtype=bool)
+    assert np.array_equal(g.active_mask, expected_active)
+    engines = g.WOFOSTgrid[g.active_mask]
+    assert all(isinstance(wofsim, GridAwareEngine) for wofsim in engines)
+    assert all(wofsim is None for wofsim in g.WOFOSTgrid[~g.active_mask])
+    assert g.get_current_time() == START_DATE
+
+    for _ in range(30):
+        g.update()
+    assert g.get_current_time() == START_DATE + dt.timedelta(days=30)
+    LAI = g.get_value("LAI")
+    assert np.all(LAI[g.active_mask] > 0.)
+    assert np.all(np.isnan(LAI[~g.active_mask]))
+    if production_level == "water-limited":
+        assert np.all(np.isfinite(g.waterbalance.SM[g.active_mask]))
+        assert np.all(np.isfinite(g.waterbalance.DSOS[g.active_mask]))
+
+
+def run_days(g, ndays):
+    for _ in range(ndays):
+        g.update()
+
+
+@pytest.mark.parametrize("production_level", ["potential", "water-limited"])
+def test_reconfigure_changed_cell(make_config, tmp_path, production_level):
+    g = GriddedWOFOSTBMI(make_config(production_level))
+    run_days(g, 20)
+    old_engines = g.WOFOSTgrid.copy()
+
+    crop_rotations = np.array(CROP_ROTATION_MAP)
+    crop_rotations[0, 0] = 2
+    write_grid(tmp_path / "crop_rotation.tif", crop_rotations)
+    g.reconfigure()
+
+    rebuilt = g.WOFOSTgrid != old_engines
+    assert np.array_equal(rebuilt, np.array([[1, 0, 0, 0], [0, 0, 0, 0], [0, 0, 0, 0]], dtype=bool))
+    assert g.WOFOSTgrid[0, 0].day == g.get_current_time() == START_DATE + dt.timedelta(days=20)
+    run_days(g, 25)
+    assert all(wofsim.day == g.get_current_time() for wofsim in g.WOFOSTgrid[g.active_mask])
+    # the rebuilt cell follows crop rotation type 2, like its neighbour
+    LAI = g.get_value("LAI")
+    assert LAI[0, 0] > 0.
+    if production_level == "potential":
+        assert LAI[0, 0] == LAI[0, 2]
+
+
+def test_reconfigure_modified_agromanagement(make_config, tmp_path):
+    g = GriddedWOFOSTBMI(make_config("potential"))
+    run_days(g, 20)
+    old_engines = g.WOFOSTgrid.copy()
+    LAI = g.get_value("LAI")
+    assert np.all(LAI[g.crop_rotation_map == 2] == 0.)
+
+    # crop rotation type 2 now emerges at the same date as type 1
+    fname = write_agromanagement(tmp_path / "agromanagement", 1, 2, CROP_START_DATES[1])
+    mtime = os.path.getmtime(fname) + 10.
+    os.utime(fname, (mtime, mtime))
+    g.reconfigure()
+
+    rebuilt = g.WOFOSTgrid != old_engines
+    assert np.array_equal(rebuilt, g.active_mask & (g.crop_rotation_map == 2))
+    assert all(wofsim.day == g.get_current_time() for wofsim in g.WOFOSTgrid[rebuilt])
+    assert g.get_current_time() == START_DATE + dt.timedelta(days=20)
+    # without water stress the cells in a row (same latitude) now have the same crop
+    LAI = g.get_value("LAI")
+    assert np.all(LAI[g.active_mask] > 0.)
+    for row in range(LAI.shape[0]):
+        assert np.all(LAI[row, g.active_mask[row]] == LAI[row, 0])
+
+    # unchanged files are not rebuilt again
+    old_engines = g.WOFOSTgrid.copy()
+    g.reconfigure()
+    assert np.all(g.WOFOSTgrid == old_engines)
+
+
+def test_reconfigure_requires_initialize(make_config):
+    config_file = make_config("potential")
+    g = GriddedWOFOSTBMI(config_file)
+    run_days(g, 20)
+    old_engines = g.WOFOSTgrid.copy()
+
+    make_config("potential", weather_variables={"max_open_files": 2})
+    g.reconfigure(config_file)
+
+    assert not np.any((g.WOFOSTgrid == old_engines)[g.active_mask])
+    assert g.get_current_time() == START_DATE
+    assert g.WFLOWWeatherDataProvider.max_open_files == 2
+
+
+def transpiration_forcing(fraction):
+    """Returns a forcing that sets the actual transpiration to a fraction of the potential.
+    """
+    def forcing(model, day):
+        shape = model.WOFOSTgrid.shape
+        model.set_value("PotTrans", np.full(shape, 3.))
+        model.set_value("Transpiration", np.full(shape, 3. * fraction))
+    return forcing
+
+
+def test_fork_branches(make_config):
+    g = GriddedWOFOSTBMI(make_config("potential"))
+    run_days(g, 20)
+    current_day = g.get_current_time()
+    until = current_day + dt.timedelta(days=15)
+
+    outputs = {0: [], 1: []}
+    branches = [{"forcing": transpiration_forcing(1.0)}, {"forcing": transpiration_forcing(0.2)}]
+    for branch_number, day, values in g.fork(branches, output_variables=("LAI", "TAGP"), until=until):
+        outputs[branch_number].append((day, values))
+
+    expected_days = [current_day + dt.timedelta(days=i) for i in range(1, 16)]
+    for branch_number in (0, 1):
+        assert [day for day, _ in outputs[branch_number]] == expected_days
+    # water stress in branch 1 reduces growth
+    TAGP_0, TAGP_1 = outputs[0][-1][1]["TAGP"], outputs[1][-1][1]["TAGP"]
+    emerged = g.get_value("LAI") > 0.
+    assert np.all(TAGP_1[emerged] < TAGP_0[emerged])
+    # the state of the model itself did not change
+    assert g.get_current_time() == current_day
+
+
+def test_fork_failing_branch(make_config):
+    g = GriddedWOFOSTBMI(make_config("potential"))
+    run_days(g, 5)
+
+    def failing_forcing(model, day):
+        raise ValueError("no forcing available")
+
+    branches = [{"forcing": transpiration_forcing(1.0)}, {"forcing": failing_forcing}]
+    with pytest.raises(RuntimeError, match="Forecast branch 1 failed(.|\\n)*no forcing available"):
+        list(g.fork(branches, until=g.get_current_time() + dt.timedelta(days=5)))
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 Wageningeni Environmental Research, Wageningen-UR
+# Allard de Wit (allard.dewit@wur.nl), December 2019
+import datetime as dt
+from collections import namedtuple
+
+import numpy as np
+import pytest
+
+from pcse.base import VariableKiosk
+from pcse.soil.classic_waterbalance import WaterbalanceFD
+
+from griddedwofostbmi.waterbalance import GridWaterbalanceFD
+
+Drivers = namedtuple("Drivers", "RAIN E0 ES0")
+
+SOIL_PARAMETERS = {"SM0": [[0.40, 0.45, 0.38]], "SMFCF": [[0.25, 0.32, 0.20]], "SMW": [[0.10, 0.12, 0.06]],
+                   "CRAIRC": [[0.04, 0.06, 0.05]], "RDMSOL": [[120., 80., 150.]],
+                   "SOPE": [[0.55, 1.2, 2.0]], "KSUB": [[0.37, 0.6, 1.5]]}
+# Dry spell, a wet period that saturates the soil and builds surface storage, small showers
+# while the surface storage drains (storm size dependent infiltration), then drying
+RAIN = [0., 0., 0.3, 0., 1.2, 6., 8., 8., 8., 3., 0.4, 0.6, 0., 1., 0., 0., 0., 0., 0., 0.]
+E0, ES0 = 0.45, 0.35
+
+
+def run_pcse_waterbalance(cell, site_parameters, crop_rates):
+    """Runs the PCSE WaterbalanceFD for one cell, crop rates are published in the kiosk.
+    """
+    parvalues = dict(site_parameters)
+    parvalues.update({name: values[0][cell] for name, values in SOIL_PARAMETERS.items()})
+    kiosk = VariableKiosk()
+    day = dt.date(2010, 3, 1)
+    wb = WaterbalanceFD(day, kiosk, parvalues)
+    crop_id = id(crop_rates)
+    if crop_rates:
+        for varname in ("TRA", "EVWMX", "EVSMX"):
+            kiosk.register_variable(crop_id, varname, type="R", publish=True)
+        kiosk.register_variable(crop_id, "RD", type="S", publish=True)
+
+    states = []
+    for i, rain in enumerate(RAIN):
+        if crop_rates:
+            for varname, values in crop_rates.items():
+                kiosk.set_variable(crop_id, varname, values[i])
+        wb.calc_rates(day, Drivers(RAIN=rain, E0=E0, ES0=ES0))
+        wb.integrate(day, 1.0)
+        s = wb.states
+        states.append({"SM": s.SM, "W": s.W, "WLOW": s.WLOW, "SS": s.SS, "DSOS": s.DSOS})
+        day += dt.timedelta(days=1)
+    return states
+
+
+def run_grid_waterbalance(site_parameters, crop_rates):
+    """Runs the GridWaterbalanceFD for all cells, without crop the rates are NaN.
+    """
+    soil_parameters = {name: np.array(values) for name, values in SOIL_PARAMETERS.items()}
+    shape = soil_parameters["SM0"].shape
+    wb = GridWaterbalanceFD(soil_parameters, site_parameters, np.ones(shape, dtype=bool))
+
+    states = []
+    for i, rain in enumerate(RAIN):
+        rates = {varname: np.full(shape, values[i] if crop_rates else np.NaN)
+                 for varname, values in (crop_rates or dict.fromkeys(("TRA", "EVWMX", "EVSMX", "RD"), None)).items()}
+        wb.update(RAIN=np.full(shape, rain), E0=np.full(shape, E0), ES0=np.full(shape, ES0), **rates)
+        states.append({name: getattr(wb, name).copy() for name in ("SM", "W", "WLOW", "SS", "DSOS")})
+    return states
+
+
+@pytest.mark.parametrize("IFUNRN", [0, 1])
+@pytest.mark.parametrize("with_crop", [False, True])
+def test_grid_waterbalance_equals_pcse(IFUNRN, with_crop):
+    site_parameters = {"IFUNRN": IFUNRN, "NOTINF": 0.3, "SSI": 0., "SSMAX": 2., "WAV": 20., "SMLIM": 0.4}
+    crop_rates = {}
+    if with_crop:
+        # Rooting depth increases during the run, the crop rates are the same for all cells
+        ndays = len(RAIN)
+        crop_rates = {"TRA": np.linspace(0.05, 0.3, ndays),
+                      "EVWMX": np.full(ndays, 0.2),
+                      "EVSMX": np.full(ndays, 0.1),
+                      "RD": np.minimum(10. + 4. * np.arange(ndays), 60.)}
+
+    grid_states = run_grid_waterbalance(site_parameters, crop_rates)
+    assert max(s["SS"].max() for s in grid_states) > 0.1, "surface storage is not tested"
+    assert max(s["DSOS"].max() for s in grid_states) > 0, "days since oxygen stress are not tested"
+    for cell in range(len(SOIL_PARAMETERS["SM0"][0])):
+        pcse_states = run_pcse_waterbalance(cell, site_parameters, crop_rates)
+        for day, (grid_state, pcse_state) in enumerate(zip(grid_states, pcse_states)):
+            for name, value in pcse_state.items():
+                assert grid_state[name][0, cell] == pytest.approx(value, abs=1e-9), \
+                    f"{name} differs on day {day} for cell {cell}"
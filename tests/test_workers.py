@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2019 Wageningeni Environmental Research, Wageningen-UR
+# Allard de Wit (allard.dewit@wur.nl), December 2019
+import numpy as np
+import pytest
+
+from griddedwofostbmi.model import GriddedWOFOSTBMI
+from griddedwofostbmi.workers import split_grid
+
+from conftest import write_grid, CROP_ROTATION_MAP
+
+
+def test_split_grid():
+    active = np.array([[0, 1, 1, 0], [1, 1, 0, 0], [0, 0, 1, 1]], dtype=bool)
+    parts = split_grid(active, 3)
+    assert len(parts) == 3
+    # every cell has exactly one owner, active cells are spread evenly
+    assert np.array_equal(np.sum(parts, axis=0), np.ones(active.shape))
+    assert [np.count_nonzero(part & active) for part in parts] == [2, 2, 2]
+    # never more parts than active cells
+    assert len(split_grid(active, 10)) == np.count_nonzero(active)
+
+
+@pytest.mark.parametrize("production_level", ["potential", "water-limited"])
+def test_workers_equal_serial_run(make_config, production_level):
+    serial = GriddedWOFOSTBMI(make_config(production_level))
+    parallel = GriddedWOFOSTBMI(make_config(production_level, fname="parallel.yaml",
+                                            runtime={"processes": 3}))
+    try:
+        assert len(parallel._workers) == 3
+        # the engines are owned by the workers
+        assert all(wofsim is None for wofsim in parallel.WOFOSTgrid.flatten())
+        assert parallel.get_start_time() == serial.get_start_time()
+        assert parallel.get_end_time() == serial.get_end_time()
+
+        transpiration = np.full(serial.WOFOSTgrid.shape, 2.)
+        transpiration[:, :2] = 0.5
+        for _ in range(40):
+            for g in (serial, parallel):
+                g.set_value("Transpiration", transpiration)
+                g.set_value("PotTrans", np.full(serial.WOFOSTgrid.shape, 2.))
+                g.update()
+        assert parallel.get_current_time() == serial.get_current_time()
+        for varname in ("LAI", "TAGP", "DVS"):
+            np.testing.assert_array_equal(parallel.get_value(varname), serial.get_value(varname))
+    finally:
+        parallel._stop_workers()
+
+
+def test_workers_reconfigure(make_config, tmp_path):
+    config_file = make_config("water-limited", runtime={"processes": 2})
+    serial = GriddedWOFOSTBMI(make_config("water-limited"))
+    parallel = GriddedWOFOSTBMI(config_file)
+    try:
+        for _ in range(10):
+            serial.update()
+            parallel.update()
+
+        # the inactive cell of crop rotation type 3 becomes active
+        crop_rotations = np.array(CROP_ROTATION_MAP)
+        crop_rotations[2, 2] = 1
+        write_grid(tmp_path / "crop_rotation.tif", crop_rotations)
+        serial.reconfigure()
+        parallel.reconfigure()
+        assert parallel.active_mask[2, 2]
+        for _ in range(10):
+            serial.update()
+            parallel.update()
+        np.testing.assert_array_equal(parallel.get_value("LAI"), serial.get_value("LAI"))
+    finally:
+        parallel._stop_workers()
+
+
+def test_worker_errors_are_raised(make_config):
+    g = GriddedWOFOSTBMI(make_config(runtime={"processes": 2}))
+    try:
+        with pytest.raises(RuntimeError, match="Grid worker 0 failed"):
+            g._call_workers("get_value", "NOT_A_VARIABLE")
+        # the workers are still usable after a failed call
+        assert g.get_value("LAI").shape == g.WOFOSTgrid.shape
+        with pytest.raises(RuntimeError, match="not supported"):
+            g.fork([{}])
+    finally:
+        g._stop_workers()